@@ -0,0 +1,34 @@
+# --- kernels.py (cuantización vectorizada para alertas con varios símbolos) ---
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    # numba está en requirements.txt; si falta (p. ej. plataforma sin wheel) se usa la versión NumPy.
+    njit = None
+
+
+def _quantize_batch_numpy(quantities, step, scale, min_qty):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = np.rint(np.floor(quantities / step + 1e-9) * step * scale) / scale
+    # NaN/inf (precio o paso inválido) nunca deben llegar a una orden.
+    out[~np.isfinite(out) | (out < min_qty)] = 0.0
+    return out
+
+
+if njit is not None:
+    # Sin fastmath: el redondeo final con `scale` tiene que ser el IEEE exacto para que el
+    # resultado coincida con el decimal que acepta Binance (igual que la ruta escalar de
+    # server._process_single). error_model='numpy': dividir por un paso 0 da inf/NaN (que luego se
+    # descartan) igual que en la versión NumPy, en vez de lanzar ZeroDivisionError.
+    @njit(cache=True, error_model='numpy')
+    def _quantize_batch_jit(quantities, step, scale, min_qty):
+        out = np.empty_like(quantities)
+        for i in range(quantities.shape[0]):
+            v = np.rint(np.floor(quantities[i] / step[i] + 1e-9) * step[i] * scale[i]) / scale[i]
+            out[i] = v if np.isfinite(v) and v >= min_qty[i] else 0.0
+        return out
+
+    quantize_batch = _quantize_batch_jit
+else:
+    quantize_batch = _quantize_batch_numpy
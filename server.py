@@ -1,193 +1,780 @@
 # --- server.py (VERSIÓN ROBUSTA + /ping) ---
+# gevent tiene que parchear sockets/hilos antes de importar requests (cliente de Binance):
+# cada llamada REST bloqueante cede el control a otros webhooks en lugar de bloquear un hilo.
+from gevent import monkey
+monkey.patch_all()
+
 import os
+import atexit
+import hashlib
+import hmac
 import json
 import logging
 import math
-from datetime import datetime, timezone
-from flask import Flask, request, jsonify
+import sys
+import threading
+import time
+from decimal import Decimal
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from types import MappingProxyType
+from typing import Annotated, List, Optional, Union
+import msgspec
+import numpy as np
+import orjson
+from flask import Flask, Response, request
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from binance import ThreadedWebsocketManager
 from binance.client import Client
 from binance.exceptions import BinanceAPIException
 from dotenv import load_dotenv
+from kernels import quantize_batch
 
 # --- 1. CONFIGURACIÓN INICIAL ---
 load_dotenv()
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[logging.FileHandler("bot.log"), logging.StreamHandler()]
-)
+# El request sólo encola el registro; un hilo aparte (QueueListener) formatea y escribe a disco.
+class NativeQueueListener(QueueListener):
+    """QueueListener en un hilo real del sistema operativo.
+
+    Con patch_all() threading.Thread es un greenlet y cada escritura a disco bloquearía el hub;
+    aquí el hilo, el lock de parada y la cola (log_queue) son los originales sin parchear.
+    """
+
+    def start(self):
+        self._done = monkey.get_original('_thread', 'allocate_lock')()
+        self._done.acquire()
+        monkey.get_original('_thread', 'start_new_thread')(self._run, ())
+
+    def _run(self):
+        try:
+            self._monitor()
+        finally:
+            self._done.release()
+
+    def stop(self):
+        self.enqueue_sentinel()
+        self._done.acquire()
+
+log_queue = monkey.get_original('queue', 'SimpleQueue')()
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+file_handler = RotatingFileHandler("bot.log", maxBytes=5_000_000, backupCount=3)
+stream_handler = logging.StreamHandler()
+file_handler.setFormatter(log_formatter)
+stream_handler.setFormatter(log_formatter)
+log_listener = NativeQueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+queue_handler = QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
 app = Flask(__name__)
-START_TS = datetime.now(timezone.utc)
+START_TS_EPOCH = time.time()
 
 # --- 2. CREDENCIALES Y CLIENTE DE BINANCE ---
 API_KEY = os.getenv("API_KEY")
 API_SECRET = os.getenv("API_SECRET")
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
 if not all([API_KEY, API_SECRET, WEBHOOK_SECRET]):
-    logging.error("FATAL: Faltan variables de entorno (API_KEY, API_SECRET o WEBHOOK_SECRET).")
-    exit()
+    logging.critical("FATAL: Faltan variables de entorno (API_KEY, API_SECRET o WEBHOOK_SECRET).")
+    sys.exit(1)
+WEBHOOK_SECRET_B = WEBHOOK_SECRET.encode()
 
-client = Client(API_KEY, API_SECRET, testnet=True)
+class BinanceClient(Client):
+    """Client que codifica API_SECRET a bytes una sola vez en vez de en cada petición firmada."""
+
+    def __init__(self, api_key, api_secret, **kwargs):
+        self._api_secret_b = api_secret.encode()
+        super().__init__(api_key, api_secret, **kwargs)
+
+    def _hmac_signature(self, query_string):
+        return hmac.new(self._api_secret_b, query_string.encode(), hashlib.sha256).hexdigest()
+
+client = BinanceClient(API_KEY, API_SECRET, testnet=True)
+# Pool keep-alive dimensionado para las llamadas concurrentes de io_pool; sólo se reintentan
+# errores de conexión en métodos idempotentes (las órdenes POST nunca se reenvían).
+client.session.mount('https://', HTTPAdapter(
+    pool_connections=4, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.1)
+))
+client.futures_ping()  # Abre la conexión TLS con el host de futuros antes del primer webhook.
 logging.info("Cliente de Binance inicializado en modo Testnet.")
+# Acción de la alerta -> lado de la orden (None = sólo cerrar).
+ACTION_SIDE = MappingProxyType({'LONG': 'BUY', 'BUY': 'BUY', 'SHORT': 'SELL', 'SELL': 'SELL', 'CLOSE': None})
+# Lado contrario indexado por un booleano: SIDES[largo] cierra/protege la posición.
+SIDES = ('BUY', 'SELL')
 symbol_info_cache = {}
+SYMBOL_INFO_PATH = "symbol_info.json"
+SYMBOL_INFO_TTL = 24 * 3600
+# Símbolos desconocidos: se recuerdan SYMBOL_MISS_TTL segundos y la tabla completa se descarga
+# como mucho una vez cada SYMBOL_REFRESH_INTERVAL, para que alertas con símbolos inválidos no
+# disparen una descarga de exchangeInfo cada una.
+SYMBOL_MISS_TTL = 300
+SYMBOL_REFRESH_INTERVAL = 60
+_symbol_info_misses = {}
+_last_symbol_refresh = 0.0
+# Pool para solapar llamadas REST independientes dentro de un mismo webhook.
+io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="binance-io")
+# Pool aparte para alertas con "signals": cada señal espera a io_pool, compartirlo podría bloquearse.
+signal_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="signal")
+SIGNAL_TIMEOUT = 20
+
+# Caché de corta duración: las alertas de TradingView suelen llegar en ráfagas para el mismo símbolo.
+# Cada entrada es (valor, expira_en) con expira_en medido en time.monotonic().
+MARK_PRICE_TTL = 0.5
+POSITION_TTL = 1.0
+_mark_price_cache = {}
+_position_cache = {}
+# Último apalancamiento aplicado por símbolo: futures_change_leverage sólo se llama si cambia.
+_leverage_cache = {}
+# Vista en memoria alimentada por WebSocket (posiciones y precios de marca). Los precios sólo se usan
+# mientras el stream de precios (cada 1 s) siga llegando. Las posiciones vienen únicamente de
+# ACCOUNT_UPDATE, como (cantidad, recibido_en): el stream de usuario no tiene latido propio, así que
+# se usan mientras no haya reportado error y durante STREAM_POSITION_MAX_AGE segundos; si no, REST.
+STREAM_MAX_AGE = 2.0
+STREAM_POSITION_MAX_AGE = 30.0
+_stream_positions = {}
+_stream_marks = {}
+_stream_heartbeat = 0.0
+_user_stream_alive = False
+# updateTime (ms, reloj de Binance) de la última orden enviada por símbolo: eventos anteriores se ignoran.
+_stream_fence = {}
+# Deduplicación de alertas repetidas (reintentos / doble disparo de TradingView): clave -> time.time().
+DEDUP_WINDOW = 10
+DEDUP_BUCKET = 5
+_seen_signals = {}
+_seen_lock = threading.Lock()
+_seen_counter = 0
+# Símbolos con órdenes abiertas conocidas (TSL colocados por el bot u órdenes vivas al arrancar).
+# Sólo se cancela antes de cerrar si el símbolo está aquí, ahorrando una llamada REST.
+# Desde python-binance 1.0.37 los TRAILING_STOP_MARKET van al endpoint de órdenes algo
+# (conditional=True): hay que consultarlos y cancelarlos aparte de las órdenes normales.
+symbols_with_open_orders = set()
 
 # --- 3. FUNCIONES AUXILIARES ---
-def get_symbol_info(symbol):
-    if symbol not in symbol_info_cache:
+def ojson(payload, status=200):
+    """Equivalente a jsonify() serializando con orjson."""
+    return Response(orjson.dumps(payload), status, mimetype='application/json')
+
+def _fast_iso(ts):
+    """Timestamp epoch -> ISO 8601 UTC, sin construir objetos datetime."""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(ts))
+
+def _parse_symbol_filters(s):
+    filters = {f['filterType']: f for f in s['filters']}
+    return {
+        'tickSize': float(filters['PRICE_FILTER']['tickSize']),
+        'stepSize': float(filters['LOT_SIZE']['stepSize']),
+        'minQty': float(filters['LOT_SIZE']['minQty'])
+    }
+
+def _valid_symbols(entries, parse=dict):
+    """{símbolo: filtros} con los multiplicadores ya calculados; las entradas mal formadas se omiten."""
+    out = {}
+    for symbol, entry in entries:
         try:
-            logging.info(f"Obteniendo información de filtros para {symbol} por primera vez.")
-            exchange_info = client.futures_exchange_info()
-            for s in exchange_info['symbols']:
-                if s['symbol'] == symbol:
-                    symbol_info_cache[symbol] = {
-                        'tickSize': float(next(f['tickSize'] for f in s['filters'] if f['filterType'] == 'PRICE_FILTER')),
-                        'stepSize': float(next(f['stepSize'] for f in s['filters'] if f['filterType'] == 'LOT_SIZE')),
-                        'minQty': float(next(f['minQty'] for f in s['filters'] if f['filterType'] == 'LOT_SIZE'))
-                    }
-                    break
-        except BinanceAPIException as e:
-            logging.error(f"Error obteniendo info para {symbol}: {e}")
+            out[symbol] = _with_multipliers(parse(entry))
+        except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+            logging.warning("Filtros inválidos para %s, se omite: %r", symbol, e)
+    return out
+
+def _with_multipliers(info):
+    # Una cantidad válida es (n pasos) * stepSize con los decimales de stepSize; stepScale = 10**decimales
+    # permite redondear ese producto al decimal exacto. Vale para pasos 0.001, 1, 10 o 0.3.
+    if not info['stepSize'] > 0:
+        raise ValueError(f"stepSize inválido: {info['stepSize']}")
+    decimals = max(0, -Decimal(str(info['stepSize'])).normalize().as_tuple().exponent)
+    info['stepScale'] = 10.0 ** decimals
+    return info
+
+def refresh_symbol_info():
+    """Descarga los filtros de todos los símbolos en una sola llamada y los persiste en disco."""
+    global _last_symbol_refresh
+    _last_symbol_refresh = time.monotonic()
+    logging.info("Descargando información de filtros de todos los símbolos.")
+    exchange_info = client.futures_exchange_info()
+    fresh = _valid_symbols(((s['symbol'], s) for s in exchange_info['symbols'] if 'symbol' in s), _parse_symbol_filters)
+    tmp_path = SYMBOL_INFO_PATH + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({symbol: {k: info[k] for k in ('tickSize', 'stepSize', 'minQty')} for symbol, info in fresh.items()}, f)
+    os.replace(tmp_path, SYMBOL_INFO_PATH)
+    symbol_info_cache.update(fresh)
+
+def load_symbol_info():
+    """Carga los filtros desde disco si el archivo es reciente; si no, los descarga de nuevo."""
+    try:
+        if os.path.getmtime(SYMBOL_INFO_PATH) > time.time() - SYMBOL_INFO_TTL:
+            with open(SYMBOL_INFO_PATH) as f:
+                symbol_info_cache.update(_valid_symbols(json.load(f).items()))
+            logging.info("Información de %s símbolos cargada desde %s.", len(symbol_info_cache), SYMBOL_INFO_PATH)
+            return
+    except (OSError, ValueError) as e:
+        logging.warning("No se pudo leer %s, se descargará de nuevo: %s", SYMBOL_INFO_PATH, e)
+    try:
+        refresh_symbol_info()
+    except (BinanceAPIException, OSError) as e:
+        logging.error("Error precargando información de símbolos: %s", e)
+
+def get_symbol_info(symbol):
+    info = symbol_info_cache.get(symbol)
+    if info is None:
+        now = time.monotonic()
+        if _symbol_info_misses.get(symbol, 0.0) > now:
             return None
-    return symbol_info_cache[symbol]
+        # Símbolo no visto (p. ej. recién listado): se refresca la tabla completa, con límite de frecuencia.
+        if now - _last_symbol_refresh >= SYMBOL_REFRESH_INTERVAL:
+            try:
+                logging.info("%s no está en caché, refrescando información de filtros.", symbol)
+                refresh_symbol_info()
+            except (BinanceAPIException, OSError) as e:
+                logging.error("Error obteniendo info para %s: %s", symbol, e)
+                return None
+            info = symbol_info_cache.get(symbol)
+        if info is None:
+            logging.warning("%s no existe en exchangeInfo; se ignora durante %ss.", symbol, SYMBOL_MISS_TTL)
+            if len(_symbol_info_misses) > 1000:
+                _symbol_info_misses.clear()
+            _symbol_info_misses[symbol] = now + SYMBOL_MISS_TTL
+    return info
 
-def adjust_quantity(quantity, step_size, min_qty):
-    precision = int(round(-math.log(step_size, 10), 0))
-    formatted_quantity = math.floor(quantity * (10**precision)) / (10**precision)
-    if formatted_quantity < min_qty:
-        logging.error(f"Cantidad calculada ({formatted_quantity}) es menor que el mínimo permitido ({min_qty}).")
-        return 0.0
-    return formatted_quantity
+load_symbol_info()
+
+def load_open_orders():
+    """Registra los símbolos que ya tienen órdenes abiertas al arrancar (normales y condicionales)."""
+    try:
+        symbols_with_open_orders.update(o['symbol'] for o in client.futures_get_open_orders())
+        symbols_with_open_orders.update(o['symbol'] for o in client.futures_get_open_orders(conditional=True))
+        logging.info("Símbolos con órdenes abiertas al arrancar: %s.", sorted(symbols_with_open_orders) or 'ninguno')
+    except BinanceAPIException as e:
+        logging.error("Error obteniendo órdenes abiertas: %s", e)
+
+load_open_orders()
+
+def load_leverages():
+    """Precarga el apalancamiento actual de todos los símbolos (positionRisk v3 ya no lo trae)."""
+    try:
+        _leverage_cache.update((c['symbol'], int(c['leverage'])) for c in client.futures_symbol_config())
+        logging.info("Apalancamiento conocido para %s símbolos.", len(_leverage_cache))
+    except (BinanceAPIException, OSError, KeyError, ValueError) as e:
+        logging.error("Error obteniendo el apalancamiento por símbolo: %s", e)
+
+load_leverages()
+
+def stream_is_fresh():
+    return time.monotonic() - _stream_heartbeat <= STREAM_MAX_AGE
+
+def _stream_position(symbol):
+    """Posición según el stream de usuario, o None si no hay un valor confiable."""
+    entry = _stream_positions.get(symbol)
+    if entry is None or not _user_stream_alive or time.monotonic() - entry[1] > STREAM_POSITION_MAX_AGE:
+        return None
+    return entry[0]
+
+def _on_mark_prices(msg):
+    global _stream_heartbeat
+    if isinstance(msg, dict):
+        # python-binance entrega los errores del socket como {'e': 'error', ...}
+        logging.warning("Stream de precios de marca con error: %s", msg)
+        return
+    for m in msg:
+        _stream_marks[m['s']] = float(m['p'])
+    _stream_heartbeat = time.monotonic()
+
+def _on_user_event(msg):
+    global _user_stream_alive
+    event = msg.get('e')
+    if event in ('error', 'listenKeyExpired'):
+        # Pudieron perderse eventos durante la reconexión: se descarta la vista de posiciones
+        # hasta que vuelva a llegar un evento.
+        logging.warning("Stream de usuario con error, se usará REST: %s", msg)
+        _user_stream_alive = False
+        _stream_positions.clear()
+        return
+    _user_stream_alive = True
+    if event == 'ACCOUNT_UPDATE':
+        now = time.monotonic()
+        for p in msg['a']['P']:
+            if p.get('ps', 'BOTH') == 'BOTH' and msg.get('T', 0) >= _stream_fence.get(p['s'], 0):
+                _stream_positions[p['s']] = (float(p['pa']), now)
+    elif event == 'ACCOUNT_CONFIG_UPDATE' and 'ac' in msg:
+        _leverage_cache[msg['ac']['s']] = int(msg['ac']['l'])
+
+def start_streams():
+    """Suscribe precios de marca de todos los símbolos y eventos de cuenta en un hilo aparte."""
+    try:
+        twm = ThreadedWebsocketManager(api_key=API_KEY, api_secret=API_SECRET, testnet=True)
+        # twm.start() crearía un threading.Thread, que con patch_all() es un greenlet: el loop de
+        # asyncio bloquearía el hub. Se corre en un hilo real; los sockets parcheados funcionan igual.
+        monkey.get_original('_thread', 'start_new_thread')(twm.run, ())
+        twm.start_all_mark_price_socket(callback=_on_mark_prices)
+        twm.start_futures_user_socket(callback=_on_user_event)
+        atexit.register(twm.stop)
+        logging.info("Streams de WebSocket iniciados (precios de marca y cuenta).")
+    except Exception as e:
+        logging.error("No se pudieron iniciar los streams de WebSocket, se usará sólo REST: %s", e)
+
+start_streams()
+
+def get_mark_price(symbol, ttl=MARK_PRICE_TTL):
+    """Precio de marca de un símbolo: del stream si está al día; si no, REST cacheado `ttl` segundos."""
+    if stream_is_fresh():
+        price = _stream_marks.get(symbol)
+        if price is not None:
+            return price
+    now = time.monotonic()
+    cached = _mark_price_cache.get(symbol)
+    if cached and cached[1] > now:
+        return cached[0]
+    price = float(client.futures_mark_price(symbol=symbol)['markPrice'])
+    _mark_price_cache[symbol] = (price, now + ttl)
+    return price
+
+def get_open_position(symbol, ttl=POSITION_TTL):
+    """Cantidad de la posición abierta para un símbolo (0.0 si no hay), cacheada durante `ttl` segundos."""
+    amount = _stream_position(symbol)
+    if amount is not None:
+        return amount
+    now = time.monotonic()
+    cached = _position_cache.get(symbol)
+    if cached and cached[1] > now:
+        return cached[0]
+    # La consulta ya viene filtrada por símbolo y en modo one-way devuelve una sola entrada.
+    positions = client.futures_position_information(symbol=symbol)
+    amount = float(positions[0]['positionAmt']) if positions else 0.0
+    _position_cache[symbol] = (amount, now + ttl)
+    return amount
+
+def ensure_leverage(symbol, leverage):
+    """Aplica el apalancamiento sólo si difiere del último conocido para el símbolo."""
+    if _leverage_cache.get(symbol) != leverage:
+        client.futures_change_leverage(symbol=symbol, leverage=leverage)
+        _leverage_cache[symbol] = leverage
+
+def invalidate_cache(symbol, order=None):
+    """Descarta los valores cacheados de un símbolo. Llamar después de cada orden enviada."""
+    _mark_price_cache.pop(symbol, None)
+    _position_cache.pop(symbol, None)
+    # El ACCOUNT_UPDATE de la orden puede llegar después de la próxima lectura: hasta entonces, REST.
+    # Los eventos de órdenes anteriores que lleguen tarde no deben pisar el valor nuevo.
+    if order and 'updateTime' in order:
+        _stream_fence[symbol] = max(_stream_fence.get(symbol, 0), int(order['updateTime']))
+    _stream_positions.pop(symbol, None)
 
 def close_position_for_symbol(symbol):
     """Cierra cualquier posición abierta para un símbolo."""
+    # Ruta caliente: nombres globales ligados a locales (LOAD_FAST en vez de LOAD_GLOBAL + LOAD_ATTR).
+    log_info = logging.info
+    log_error = logging.error
+    create_order = client.futures_create_order
     try:
-        positions = client.futures_position_information(symbol=symbol)
-        position = next((p for p in positions if p['symbol'] == symbol and float(p['positionAmt']) != 0), None)
-        if not position:
-            logging.info(f"No hay posición abierta para {symbol}. No se requiere cierre.")
+        position_amount = get_open_position(symbol)
+        if position_amount == 0:
+            log_info("No hay posición abierta para %s. No se requiere cierre.", symbol)
             return True, "No position to close."
 
-        position_amount = float(position['positionAmt'])
-        side_to_close = 'SELL' if position_amount > 0 else 'BUY'
-        quantity_to_close = abs(position_amount)
+        side_to_close = SIDES[position_amount > 0]
+        quantity_to_close = -position_amount if position_amount < 0 else position_amount
 
-        client.futures_cancel_all_open_orders(symbol=symbol)
-        logging.info(f"Canceladas todas las órdenes abiertas para {symbol} antes de cerrar.")
+        if symbol in symbols_with_open_orders:
+            cancel_all = client.futures_cancel_all_open_orders
+            conditional = io_pool.submit(cancel_all, symbol=symbol, conditional=True)
+            cancel_all(symbol=symbol)
+            conditional.result()
+            symbols_with_open_orders.discard(symbol)
+            log_info("Canceladas todas las órdenes abiertas para %s antes de cerrar.", symbol)
 
-        logging.info(f"Cerrando posición existente para {symbol}: Lado={side_to_close}, Cantidad={quantity_to_close}")
-        close_order = client.futures_create_order(
-            symbol=symbol, side=side_to_close, type='MARKET', quantity=quantity_to_close
+        log_info("Cerrando posición existente para %s: Lado=%s, Cantidad=%s", symbol, side_to_close, quantity_to_close)
+        # reduceOnly: si la cantidad leída quedó vieja, la orden nunca abre una posición opuesta.
+        close_order = create_order(
+            symbol=symbol, side=side_to_close, type='MARKET', quantity=quantity_to_close, reduceOnly='true'
         )
-        logging.info(f"Posición para {symbol} cerrada exitosamente. ID: {close_order['orderId']}")
+        invalidate_cache(symbol, close_order)
+        log_info("Posición para %s cerrada exitosamente. ID: %s", symbol, close_order['orderId'])
         return True, close_order['orderId']
 
     except BinanceAPIException as e:
+        invalidate_cache(symbol)
         if e.code == -2022:
-            logging.warning(f"No se pudo cerrar la posición para {symbol} (probablemente ya cerrada). Error: {e}")
+            logging.warning("No se pudo cerrar la posición para %s (probablemente ya cerrada). Error: %s", symbol, e)
             return True, "Position likely already closed."
-        logging.error(f"Error de API al cerrar posición para {symbol}: {e}")
+        log_error("Error de API al cerrar posición para %s: %s", symbol, e)
         return False, str(e)
     except Exception as e:
-        logging.error(f"Error inesperado al cerrar posición para {symbol}: {e}")
+        log_error("Error inesperado al cerrar posición para %s: %s", symbol, e)
         return False, str(e)
 
+def place_market_order(symbol, side, quantity, tsl_percent):
+    """Envía la orden MARKET y, si corresponde, su Trailing Stop.
+
+    Devuelve (orden principal, error del Trailing Stop o None). Si la MARKET ya se llenó, un rechazo
+    del Trailing Stop no se propaga: la operación se informa como "partial" y la clave de
+    deduplicación se conserva para que un reintento no cierre y reabra la posición recién abierta.
+    """
+    log_info = logging.info
+    create_order = client.futures_create_order
+    log_info("Abriendo %s para %s %s a precio de mercado.", side, quantity, symbol)
+    order = create_order(symbol=symbol, side=side, type='MARKET', quantity=quantity)
+    invalidate_cache(symbol, order)
+    log_info("¡ÉXITO! Orden MARKET enviada. ID: %s", order['orderId'])
+
+    if 0.1 <= tsl_percent <= 5:
+        try:
+            tsl_order = create_order(
+                symbol=symbol, side=SIDES[side == 'BUY'], type='TRAILING_STOP_MARKET',
+                quantity=quantity, callbackRate=tsl_percent, workingType='MARK_PRICE'
+            )
+        except Exception as e:
+            logging.error("Orden MARKET %s abierta pero el Trailing Stop fue rechazado: %s", order['orderId'], e)
+            return order, str(e)
+        invalidate_cache(symbol, tsl_order)
+        symbols_with_open_orders.add(symbol)
+        # Las órdenes algo responden con algoId en lugar de orderId.
+        log_info("Orden Trailing Stop (%s%%) colocada. ID: %s", tsl_percent, tsl_order.get('algoId', tsl_order.get('orderId')))
+    return order, None
+
+def open_positions_batch(symbols, side, leverage, usdt_amount, tsl_percent):
+    """Abre la misma operación en varios símbolos cuantizando todas las cantidades en un solo paso.
+
+    Devuelve un dict {símbolo: resultado} con el estado y el código HTTP de cada uno
+    (mismo formato que los resultados de "signals"). Los errores se registran
+    por símbolo y nunca interrumpen a los demás (algunas órdenes pueden haberse enviado ya).
+    """
+    results = {}
+    ready = []
+    for symbol in symbols:
+        try:
+            info = get_symbol_info(symbol)
+            if not info:
+                results[symbol] = {"code": 400, "status": "error", "message": f"No se pudo obtener info para {symbol}"}
+                continue
+            close_success, message = close_position_for_symbol(symbol)
+        except Exception as e:
+            info, close_success, message = None, False, str(e)
+        if not close_success:
+            results[symbol] = {"code": 500, "status": "error", "message": message}
+            continue
+        ready.append((symbol, info))
+    if not ready:
+        return results
+
+    leverage_futures = [io_pool.submit(ensure_leverage, s, leverage) for s, _ in ready]
+    mark_futures = [io_pool.submit(get_mark_price, s) for s, _ in ready]
+    failed = set()
+    for (symbol, _), future in zip(ready, leverage_futures):
+        try:
+            future.result()
+        except Exception as e:
+            logging.error("Error fijando apalancamiento para %s: %s", symbol, e)
+            results[symbol] = {"code": 500, "status": "error", "message": str(e)}
+            failed.add(symbol)
+    marks = np.empty(len(ready))
+    for i, ((symbol, _), future) in enumerate(zip(ready, mark_futures)):
+        try:
+            marks[i] = future.result()
+        except Exception as e:
+            logging.error("Error obteniendo precio de marca para %s: %s", symbol, e)
+            results.setdefault(symbol, {"code": 500, "status": "error", "message": str(e)})
+            failed.add(symbol)
+            marks[i] = np.inf
+
+    quantities = quantize_batch(
+        (usdt_amount * leverage) / marks,
+        np.array([info['stepSize'] for _, info in ready], dtype=np.float64),
+        np.array([info['stepScale'] for _, info in ready], dtype=np.float64),
+        np.array([info['minQty'] for _, info in ready], dtype=np.float64),
+    )
+    for (symbol, _), quantity in zip(ready, quantities.tolist()):
+        if symbol in failed:
+            continue
+        if not quantity > 0:
+            results[symbol] = {"code": 400, "status": "error", "message": "La cantidad calculada es demasiado pequeña."}
+            continue
+        try:
+            order, tsl_error = place_market_order(symbol, side, quantity, tsl_percent)
+            results[symbol] = {"code": 200, "status": "success", "orderId": order['orderId']}
+            if tsl_error:
+                results[symbol].update(status="partial", tsl_error=tsl_error)
+        except BinanceAPIException as e:
+            invalidate_cache(symbol)
+            _leverage_cache.pop(symbol, None)
+            logging.error("Error de la API de Binance al abrir %s: %s", symbol, e)
+            results[symbol] = {"code": 500, "status": "error", "message": str(e)}
+        except Exception as e:
+            invalidate_cache(symbol)
+            logging.error("Un error inesperado ocurrió al abrir %s: %s", symbol, e)
+            results[symbol] = {"code": 500, "status": "error", "message": str(e)}
+    return results
+
+def _signal_desc(sig):
+    if sig.signals is not None:
+        return ";".join(_signal_desc(s) for s in sig.signals)
+    symbol = ",".join(sig.symbol) if isinstance(sig.symbol, list) else (sig.symbol or "")
+    return f"{symbol.upper()}|{(sig.side or '').upper()}"
+
+def signal_key(sig):
+    """Clave de idempotencia: la enviada por el cliente o hash de símbolo|acción|ventana de 5 s."""
+    if sig.idempotency_key:
+        return sig.idempotency_key
+    raw = f"{_signal_desc(sig)}|{int(time.time()) // DEDUP_BUCKET}"
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+def claim_signal(key):
+    """Registra la clave y devuelve False si ya se procesó dentro de DEDUP_WINDOW."""
+    global _seen_counter
+    now = time.time()
+    with _seen_lock:
+        if _seen_signals.get(key, 0) > now - DEDUP_WINDOW:
+            return False
+        _seen_signals[key] = now
+        _seen_counter += 1
+        if _seen_counter % 1000 == 0:
+            for k in [k for k, ts in _seen_signals.items() if ts < now - 3 * DEDUP_WINDOW]:
+                del _seen_signals[k]
+    return True
+
+def release_signal(key):
+    """Olvida la clave para que un reintento tras un error sí se ejecute."""
+    with _seen_lock:
+        _seen_signals.pop(key, None)
+
 # --- 4. ENDPOINTS DE SALUD / KEEP-ALIVE ---
 @app.route('/', methods=['GET'])
 def root():
-    return jsonify({
+    return ojson({
         "status": "ok",
         "service": "binance-bot",
-        "uptime_seconds": int((datetime.now(timezone.utc) - START_TS).total_seconds())
-    }), 200
+        "uptime_seconds": int(time.time() - START_TS_EPOCH)
+    })
 
 @app.route('/ping', methods=['GET', 'HEAD'])
 def ping():
-    return jsonify({
+    now = time.time()
+    return ojson({
         "status": "alive",
-        "time_utc": datetime.now(timezone.utc).isoformat(),
-        "uptime_seconds": int((datetime.now(timezone.utc) - START_TS).total_seconds())
-    }), 200
+        "time_utc": _fast_iso(now),
+        "uptime_seconds": int(now - START_TS_EPOCH)
+    })
 
 # --- 5. RUTA DEL WEBHOOK UNIFICADO ---
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    # Acepta JSON aunque no venga con Content-Type application/json (caso TradingView)
-    data = request.get_json(force=True, silent=True)
-    if not isinstance(data, dict):
-        return jsonify({"status": "error", "message": "JSON malformado o vacío"}), 400
+# Apalancamiento máximo de Binance Futures: 125x. El tope de "usdt" sólo existe para descartar inf.
+Leverage = Annotated[float, msgspec.Meta(ge=1, le=125)]
+UsdtAmount = Annotated[float, msgspec.Meta(gt=0, le=1e9)]
 
-    logging.info(f"Webhook recibido: {data}")
+class Signal(msgspec.Struct):
+    """Payload de la alerta. strict=False acepta números enviados como texto ("lev": "10").
 
-    if data.get("secret") != WEBHOOK_SECRET:
-        logging.warning("Acceso no autorizado (clave secreta inválida).")
-        return jsonify({"status": "error", "message": "No autorizado"}), 401
+    Los rangos de "lev" y "usdt" se validan al decodificar (NaN, inf, 0 o negativos dan 400),
+    antes de que se cierre ninguna posición.
 
-    try:
-        symbol = data['symbol'].upper()
-        action = data['side'].upper()
-    except KeyError as e:
-        return jsonify({"status": "error", "message": f"Dato requerido faltante: {e}"}), 400
+    Una alerta de cartera puede traer varias señales en "signals"; en ese caso sólo
+    "secret" e "idempotency_key" se leen del nivel superior.
+    """
+    symbol: Union[str, List[str], None] = None
+    side: Optional[str] = None
+    secret: str = ""
+    lev: Optional[Leverage] = None
+    usdt: Optional[UsdtAmount] = None
+    tsl: float = 0
+    idempotency_key: Optional[str] = None
+    signals: Optional[List["Signal"]] = None
+
+signal_decoder = msgspec.json.Decoder(Signal, strict=False)
+
+def webhook_multi_symbol(sig):
+    """Variante de /webhook para "symbol" como lista: misma operación en todos los símbolos.
+
+    Devuelve (código HTTP, cuerpo).
+    """
+    symbols = [s.upper() for s in sig.symbol]
+    if not symbols:
+        return 400, {"status": "error", "message": "La lista 'symbol' está vacía."}
+    if len(set(symbols)) != len(symbols):
+        return 400, {"status": "error", "message": "Símbolo repetido en 'symbol'."}
+    action = sig.side.upper()
+    side = ACTION_SIDE.get(action)
+    if side is None:
+        return 400, {"status": "error", "message": f"Acción '{action}' no soportada con varios símbolos. Usar LONG o SHORT."}
+    if sig.lev is None or sig.usdt is None:
+        return 400, {"status": "error", "message": "Datos incompletos para abrir orden: se requieren 'lev' y 'usdt'."}
+    leverage = int(sig.lev)
+    usdt_amount = sig.usdt
+    tsl_percent = sig.tsl
+
+    results = open_positions_batch(symbols, side, leverage, usdt_amount, tsl_percent)
+    return _aggregate_results(results)
+
+def _aggregate_results(results):
+    """(código HTTP, cuerpo) de una operación con varias partes (lista, o dict por símbolo).
+
+    Si alguna parte se ejecutó se responde 200 ("partial" si no todas): un código >= 400
+    liberaría la clave de deduplicación y un reintento repetiría las órdenes ya enviadas.
+    Si no se ejecutó nada y todos los fallos son 4xx, el pedido es inválido: 400, no 500.
+    """
+    parts = list(results.values()) if isinstance(results, dict) else results
+    outcomes = [r["status"] for r in parts]
+    # "pending" (timeout) y "partial" también cuentan: pueden haber enviado órdenes.
+    if not any(o in ("success", "partial", "pending") for o in outcomes):
+        client_error = all(400 <= r.get("code", 500) < 500 for r in parts)
+        return (400 if client_error else 500), {"status": "error", "results": results}
+    status = "success" if all(o == "success" for o in outcomes) else "partial"
+    return 200, {"status": status, "results": results}
+
+def _process_single(sig):
+    """Ejecuta una señal ya autenticada. Devuelve (código HTTP, cuerpo)."""
+    # Ruta caliente: mismos enlaces locales que close_position_for_symbol/place_market_order.
+    log_error = logging.error
+    submit = io_pool.submit
+    if sig.symbol is None or sig.side is None:
+        return 400, {"status": "error", "message": "Dato requerido faltante: se requieren 'symbol' y 'side'."}
+
+    # Alerta con varios símbolos ("symbol": [...]): misma operación en todos, cantidades en lote.
+    if isinstance(sig.symbol, list):
+        return webhook_multi_symbol(sig)
+
+    symbol = sig.symbol.upper()
+    action = sig.side.upper()
+
+    side = ACTION_SIDE.get(action)
+    if side is None and action != 'CLOSE':
+        return 400, {"status": "error", "message": f"Acción '{action}' no reconocida. Usar LONG, SHORT o CLOSE."}
 
     # --- LÓGICA DE ACCIÓN ---
-    if action == 'CLOSE':
+    if side is None:
         success, message = close_position_for_symbol(symbol)
         if success:
-            return jsonify({"status": "success", "message": f"Orden de cierre para {symbol} procesada.", "details": message}), 200
+            return 200, {"status": "success", "message": f"Orden de cierre para {symbol} procesada.", "details": message}
         else:
-            return jsonify({"status": "error", "message": message}), 500
+            return 500, {"status": "error", "message": message}
 
-    elif action in ['LONG', 'BUY', 'SHORT', 'SELL']:
+    else:
+        # Validar antes de cerrar: un payload incompleto no debe dejar la posición cerrada.
+        if sig.lev is None or sig.usdt is None:
+            return 400, {"status": "error", "message": "Datos incompletos para abrir orden: se requieren 'lev' y 'usdt'."}
         close_success, _ = close_position_for_symbol(symbol)
         if not close_success:
-            logging.error(f"No se pudo cerrar la posición existente para {symbol}. Se aborta la nueva orden.")
-            return jsonify({"status": "error", "message": "No se pudo cerrar la posición existente antes de abrir una nueva."}), 500
+            log_error("No se pudo cerrar la posición existente para %s. Se aborta la nueva orden.", symbol)
+            return 500, {"status": "error", "message": "No se pudo cerrar la posición existente antes de abrir una nueva."}
 
         try:
-            side = 'BUY' if action in ['LONG', 'BUY'] else 'SELL'
-            leverage = int(float(data['lev']))
-            usdt_amount = float(data['usdt'])
-            tsl_percent = float(data.get('tsl', 0))
+            leverage = int(sig.lev)
+            usdt_amount = sig.usdt
+            tsl_percent = sig.tsl
 
             info = get_symbol_info(symbol)
             if not info:
                 raise ValueError(f"No se pudo obtener info para {symbol}")
 
-            client.futures_change_leverage(symbol=symbol, leverage=leverage)
-            mark_price = float(client.futures_mark_price(symbol=symbol)['markPrice'])
-            quantity_unformatted = (usdt_amount * leverage) / mark_price
-            quantity = adjust_quantity(quantity_unformatted, info['stepSize'], info['minQty'])
-
-            if quantity <= 0:
-                msg = f"La cantidad calculada ({quantity_unformatted:.8f}) es demasiado pequeña."
-                logging.error(msg)
-                return jsonify({"status": "error", "message": msg}), 400
+            # Cambio de apalancamiento y precio de marca son independientes: se lanzan en paralelo.
+            leverage_future = submit(ensure_leverage, symbol, leverage)
+            mark_future = submit(get_mark_price, symbol)
+            leverage_future.result()
+            mark_price = mark_future.result()
+            # Nocional -> pasos enteros en una sola expresión (misma regla que kernels.quantize_batch).
+            # El épsilon evita perder un paso cuando el cociente queda en 56.99999999999999; el redondeo
+            # final con stepScale elimina restos como 0.30000000000000004.
+            step_size, step_scale = info['stepSize'], info['stepScale']
+            steps = math.floor(usdt_amount * leverage / (mark_price * step_size) + 1e-9)
+            quantity = round(steps * step_size * step_scale) / step_scale
 
-            logging.info(f"Abriendo {side} para {quantity} {symbol} a precio de mercado.")
-            order = client.futures_create_order(symbol=symbol, side=side, type='MARKET', quantity=quantity)
-            logging.info(f"¡ÉXITO! Orden MARKET enviada. ID: {order['orderId']}")
+            if quantity < info['minQty']:
+                msg = f"La cantidad calculada ({quantity}) es menor que el mínimo permitido ({info['minQty']})."
+                log_error(msg)
+                return 400, {"status": "error", "message": msg}
 
-            if 0.1 <= tsl_percent <= 5:
-                tsl_side = 'SELL' if side == 'BUY' else 'BUY'
-                tsl_order = client.futures_create_order(
-                    symbol=symbol, side=tsl_side, type='TRAILING_STOP_MARKET',
-                    quantity=quantity, callbackRate=tsl_percent, workingType='MARK_PRICE'
-                )
-                logging.info(f"Orden Trailing Stop ({tsl_percent}%) colocada. ID: {tsl_order['orderId']}")
-
-            return jsonify({"status": "success", "orderId": order['orderId'], "message": "Operación completada"}), 200
+            order, tsl_error = place_market_order(symbol, side, quantity, tsl_percent)
+            if tsl_error:
+                return 200, {"status": "partial", "orderId": order['orderId'], "tsl_error": tsl_error,
+                             "message": "Posición abierta sin Trailing Stop"}
+            return 200, {"status": "success", "orderId": order['orderId'], "message": "Operación completada"}
 
         except (KeyError, ValueError) as e:
-            return jsonify({"status": "error", "message": f"Datos incompletos o inválidos para abrir orden: {e}"}), 400
+            return 400, {"status": "error", "message": f"Datos incompletos o inválidos para abrir orden: {e}"}
         except BinanceAPIException as e:
-            logging.error(f"Error de la API de Binance al abrir: {e}")
-            return jsonify({"status": "error", "message": str(e)}), 500
+            invalidate_cache(symbol)
+            # Ante cualquier rechazo se vuelve a fijar el apalancamiento en el próximo intento.
+            _leverage_cache.pop(symbol, None)
+            log_error("Error de la API de Binance al abrir: %s", e)
+            return 500, {"status": "error", "message": str(e)}
         except Exception as e:
-            logging.error(f"Un error inesperado ocurrió al abrir: {e}")
-            return jsonify({"status": "error", "message": str(e)}), 500
+            log_error("Un error inesperado ocurrió al abrir: %s", e)
+            return 500, {"status": "error", "message": str(e)}
 
-    else:
-        return jsonify({"status": "error", "message": f"Acción '{action}' no reconocida. Usar LONG, SHORT o CLOSE."}), 400
+def _process_batch(sig):
+    """Ejecuta las señales de "signals" en paralelo. Devuelve (código HTTP, cuerpo agregado)."""
+    signals = sig.signals
+    if not signals:
+        return 400, {"status": "error", "message": "La lista 'signals' está vacía."}
+    if any(s.signals is not None for s in signals):
+        return 400, {"status": "error", "message": "No se admiten 'signals' anidadas."}
+    # Dos señales del mismo símbolo en paralelo competirían por cerrar/abrir la misma posición.
+    symbols = [sym.upper() for s in signals for sym in ([s.symbol] if isinstance(s.symbol, str) else s.symbol or [])]
+    if len(symbols) != len(set(symbols)):
+        return 400, {"status": "error", "message": "Símbolo repetido dentro de 'signals'."}
+
+    futures = [signal_pool.submit(_process_single, s) for s in signals]
+    results = []
+    for s, future in zip(signals, futures):
+        try:
+            status, body = future.result(timeout=SIGNAL_TIMEOUT)
+        except FutureTimeout:
+            # Sigue ejecutándose en signal_pool: la orden puede llegar a enviarse igual.
+            logging.error("Timeout procesando señal %s.", s.symbol)
+            status, body = 504, {"status": "pending", "message": "Timeout esperando la señal; puede haberse ejecutado."}
+        except Exception as e:
+            logging.error("Error procesando señal %s: %s", s.symbol, e)
+            status, body = 500, {"status": "error", "message": str(e)}
+        results.append({"symbol": s.symbol, "code": status, **body})
+    return _aggregate_results(results)
+
+def execute_signal(sig):
+    """Ejecuta una alerta ya autenticada (simple o con "signals"). Devuelve (código HTTP, cuerpo)."""
+    if sig.signals is not None:
+        return _process_batch(sig)
+    return _process_single(sig)
+
+@app.route('/webhook', methods=['POST'])
+def webhook():
+    raw = request.get_data(cache=False)
+
+    # Clientes que pueden firmar envían X-Signature = hex(HMAC-SHA256(secret, cuerpo)):
+    # se valida antes de decodificar el JSON. TradingView no permite cabeceras propias,
+    # así que sin firma se sigue aceptando el campo "secret" del cuerpo.
+    signature = request.headers.get('X-Signature')
+    if signature is not None:
+        expected = hmac.new(WEBHOOK_SECRET_B, raw, 'sha256').hexdigest()
+        if not hmac.compare_digest(signature.encode(), expected.encode()):
+            logging.warning("Acceso no autorizado (firma HMAC inválida).")
+            return ojson({"status": "error", "message": "No autorizado"}, 401)
+
+    # Acepta JSON aunque no venga con Content-Type application/json (caso TradingView).
+    # El decoder valida y convierte tipos en un solo paso.
+    try:
+        sig = signal_decoder.decode(raw)
+    except msgspec.ValidationError as e:
+        return ojson({"status": "error", "message": f"Datos inválidos: {e}"}, 400)
+    except msgspec.DecodeError:
+        return ojson({"status": "error", "message": "JSON malformado o vacío"}, 400)
+
+    logging.info("Webhook recibido: %s", sig)
+
+    if signature is None and not hmac.compare_digest(sig.secret.encode(), WEBHOOK_SECRET_B):
+        logging.warning("Acceso no autorizado (clave secreta inválida).")
+        return ojson({"status": "error", "message": "No autorizado"}, 401)
+
+    key = signal_key(sig)
+    if not claim_signal(key):
+        logging.info("Alerta duplicada ignorada (clave %s).", key)
+        return ojson({"status": "success", "dedup": True, "message": "Alerta duplicada ignorada."}, 200)
+
+    try:
+        status, body = execute_signal(sig)
+    except Exception:
+        release_signal(key)
+        raise
+    if status >= 400:
+        release_signal(key)
+    return ojson(body, status)
 
 if __name__ == '__main__':
-    # Nota: en producción usá gunicorn:  gunicorn server:app --preload --timeout 120 --workers 1 --threads 4
+    # Nota: en producción usá gunicorn (ver Procfile):
+    #   gunicorn server:app --worker-class gevent --workers 1 --worker-connections 200 --timeout 30
     app.run(host='0.0.0.0', port=5000, debug=False)
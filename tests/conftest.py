@@ -0,0 +1,68 @@
+# Mismo orden que server.py: parchear antes de que binance/requests importen ssl.
+from gevent import monkey
+monkey.patch_all()
+
+import os
+import sys
+import tempfile
+from unittest import mock
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.update(API_KEY="test-key", API_SECRET="test-secret", WEBHOOK_SECRET="test-webhook")
+# server.py escribe bot.log y symbol_info.json en el directorio actual.
+os.chdir(tempfile.mkdtemp(prefix="binance-bot-tests-"))
+
+EXCHANGE_INFO = {"symbols": [
+    {"symbol": "BTCUSDT", "filters": [
+        {"filterType": "PRICE_FILTER", "tickSize": "0.10"},
+        {"filterType": "LOT_SIZE", "stepSize": "0.001", "minQty": "0.001"},
+    ]},
+    {"symbol": "ONEUSDT", "filters": [
+        {"filterType": "PRICE_FILTER", "tickSize": "0.0001"},
+        {"filterType": "LOT_SIZE", "stepSize": "1", "minQty": "1"},
+    ]},
+    {"symbol": "TENUSDT", "filters": [
+        {"filterType": "PRICE_FILTER", "tickSize": "0.00001"},
+        {"filterType": "LOT_SIZE", "stepSize": "10", "minQty": "10"},
+    ]},
+    # Sin LOT_SIZE: debe omitirse sin romper el arranque.
+    {"symbol": "BADUSDT", "filters": [{"filterType": "PRICE_FILTER", "tickSize": "0.1"}]},
+]}
+
+
+@pytest.fixture(scope="session")
+def server():
+    """Importa server.py sin red: el cliente REST y los WebSockets de Binance quedan simulados."""
+    from binance.client import Client
+    with mock.patch.multiple(
+        Client,
+        ping=mock.DEFAULT,
+        futures_ping=mock.DEFAULT,
+        futures_exchange_info=mock.Mock(return_value=EXCHANGE_INFO),
+        futures_get_open_orders=mock.Mock(return_value=[]),
+        futures_symbol_config=mock.Mock(return_value=[{"symbol": "BTCUSDT", "leverage": 20}]),
+    ), mock.patch("binance.ThreadedWebsocketManager", side_effect=OSError("sin red en tests")):
+        import server
+    return server
+
+
+@pytest.fixture
+def post(server):
+    """POST /webhook con el secreto correcto salvo que el payload traiga otro."""
+    client = server.app.test_client()
+
+    def send(payload, **kwargs):
+        payload.setdefault("secret", "test-webhook")
+        return client.post("/webhook", json=payload, **kwargs)
+    return send
+
+
+@pytest.fixture(autouse=True)
+def clean_state(server):
+    for cache in (server._seen_signals, server._stream_positions, server._stream_fence,
+                  server._position_cache, server._mark_price_cache):
+        cache.clear()
+    yield
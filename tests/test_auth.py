@@ -0,0 +1,41 @@
+import hashlib
+import hmac
+import json
+
+import pytest
+
+BODY = json.dumps({"symbol": "BTCUSDT", "side": "CLOSE"}).encode()
+
+
+@pytest.fixture
+def closes(server, monkeypatch):
+    calls = []
+    monkeypatch.setattr(server, "close_position_for_symbol", lambda s: calls.append(s) or (True, 1))
+    return calls
+
+
+def send(server, body, **headers):
+    return server.app.test_client().post("/webhook", data=body, headers=headers)
+
+
+def test_valid_signature_without_body_secret(server, closes):
+    signature = hmac.new(b"test-webhook", BODY, hashlib.sha256).hexdigest()
+    assert send(server, BODY, **{"X-Signature": signature}).status_code == 200
+    assert closes == ["BTCUSDT"]
+
+
+def test_invalid_signature_is_rejected(server, closes):
+    # Aun con el secreto correcto en el cuerpo: una firma presente tiene que ser válida.
+    body = json.dumps({"symbol": "BTCUSDT", "side": "CLOSE", "secret": "test-webhook"}).encode()
+    signature = hmac.new(b"otro-secreto", body, hashlib.sha256).hexdigest()
+    assert send(server, body, **{"X-Signature": signature}).status_code == 401
+    assert closes == []
+
+
+@pytest.mark.parametrize("secret,status", [("test-webhook", 200), ("incorrecto", 401), (None, 401)])
+def test_body_secret_fallback(server, closes, secret, status):
+    payload = {"symbol": "BTCUSDT", "side": "CLOSE"}
+    if secret is not None:
+        payload["secret"] = secret
+    assert send(server, json.dumps(payload).encode()).status_code == status
+    assert closes == (["BTCUSDT"] if status == 200 else [])
@@ -0,0 +1,48 @@
+def fake_single(failing):
+    def process(sig):
+        if sig.symbol in failing:
+            return 500, {"status": "error", "message": "rechazada"}
+        return 200, {"status": "success", "orderId": 1}
+    return process
+
+
+def batch(key, *symbols):
+    return {"idempotency_key": key, "signals": [
+        {"symbol": symbol, "side": "LONG", "lev": 10, "usdt": 100} for symbol in symbols
+    ]}
+
+
+def test_batch_partial_failure_keeps_key(server, post, monkeypatch):
+    monkeypatch.setattr(server, "_process_single", fake_single({"ONEUSDT"}))
+    resp = post(batch("batch-1", "BTCUSDT", "ONEUSDT"))
+    body = resp.get_json()
+    assert resp.status_code == 200 and body["status"] == "partial"
+    assert [r["code"] for r in body["results"]] == [200, 500]
+    # La señal que ya envió su orden no debe repetirse en un reintento.
+    assert post(batch("batch-1", "BTCUSDT", "ONEUSDT")).get_json()["dedup"] is True
+
+
+def test_batch_all_failed_releases_key(server, post, monkeypatch):
+    monkeypatch.setattr(server, "_process_single", fake_single({"BTCUSDT", "ONEUSDT"}))
+    assert post(batch("batch-2", "BTCUSDT", "ONEUSDT")).status_code == 500
+    assert "dedup" not in post(batch("batch-2", "BTCUSDT", "ONEUSDT")).get_json()
+
+
+def test_batch_all_invalid_is_400(server, post, monkeypatch):
+    calls = []
+    monkeypatch.setattr(server, "close_position_for_symbol", lambda s: calls.append(s) or (True, 1))
+    resp = post({"signals": [{"symbol": "BTCUSDT"}, {"symbol": "ONEUSDT"}]})
+    assert resp.status_code == 400
+    assert [r["code"] for r in resp.get_json()["results"]] == [400, 400]
+    assert calls == []
+
+
+def test_batch_mixed_failures_without_execution_is_500(server, post, monkeypatch):
+    monkeypatch.setattr(server, "_process_single", lambda sig: (400, {"status": "error"})
+                        if sig.symbol == "BTCUSDT" else (500, {"status": "error"}))
+    assert post(batch("batch-3", "BTCUSDT", "ONEUSDT")).status_code == 500
+
+
+def test_empty_batch_is_400(post):
+    resp = post({"signals": []})
+    assert resp.status_code == 400 and "vacía" in resp.get_json()["message"]
@@ -0,0 +1,67 @@
+from unittest import mock
+
+import pytest
+from binance.exceptions import BinanceAPIException
+
+
+def test_claim_and_release(server):
+    assert server.claim_signal("k1")
+    assert not server.claim_signal("k1")
+    server.release_signal("k1")
+    assert server.claim_signal("k1")
+
+
+def test_duplicate_alert_is_ignored(server, post, monkeypatch):
+    calls = []
+    monkeypatch.setattr(server, "close_position_for_symbol", lambda s: calls.append(s) or (True, 1))
+    payload = {"symbol": "BTCUSDT", "side": "CLOSE", "idempotency_key": "dup-1"}
+    assert post(dict(payload)).status_code == 200
+    resp = post(dict(payload))
+    assert resp.status_code == 200 and resp.get_json()["dedup"] is True
+    assert calls == ["BTCUSDT"]
+
+
+def test_failed_alert_releases_key(server, post, monkeypatch):
+    calls = []
+    monkeypatch.setattr(server, "close_position_for_symbol", lambda s: calls.append(s) or (False, "error"))
+    payload = {"symbol": "BTCUSDT", "side": "CLOSE", "idempotency_key": "fail-1"}
+    assert post(dict(payload)).status_code == 500
+    assert post(dict(payload)).status_code == 500
+    assert calls == ["BTCUSDT", "BTCUSDT"]
+
+
+@pytest.fixture
+def tsl_rejected(server, monkeypatch):
+    """MARKET aceptadas y Trailing Stop rechazados; devuelve la lista de MARKET enviadas."""
+    calls = []
+
+    def create_order(**params):
+        if params['type'] == 'TRAILING_STOP_MARKET':
+            raise BinanceAPIException(mock.Mock(status_code=400), 400, '{"code": -2021, "msg": "rechazada"}')
+        calls.append(params)
+        return {"orderId": 7, "updateTime": 1}
+
+    monkeypatch.setattr(server, "close_position_for_symbol", lambda s: (True, "No position to close."))
+    monkeypatch.setattr(server, "ensure_leverage", lambda s, lev: None)
+    monkeypatch.setattr(server, "get_mark_price", lambda s: 300.0)
+    monkeypatch.setattr(server.client, "futures_create_order", create_order)
+    return calls
+
+
+def test_rejected_trailing_stop_keeps_key(post, tsl_rejected):
+    payload = {"symbol": "BTCUSDT", "side": "LONG", "lev": 10, "usdt": 100, "tsl": 1, "idempotency_key": "tsl-1"}
+    resp = post(dict(payload))
+    body = resp.get_json()
+    assert resp.status_code == 200 and body["status"] == "partial"
+    assert body["orderId"] == 7 and "rechazada" in body["tsl_error"]
+    # El reintento no vuelve a abrir la posición.
+    assert post(dict(payload)).get_json()["dedup"] is True
+    assert len(tsl_rejected) == 1
+
+
+def test_rejected_trailing_stop_in_multi_symbol_is_partial(post, tsl_rejected):
+    resp = post({"symbol": ["BTCUSDT", "ONEUSDT"], "side": "LONG", "lev": 10, "usdt": 100, "tsl": 1})
+    body = resp.get_json()
+    assert resp.status_code == 200 and body["status"] == "partial"
+    assert {r["status"] for r in body["results"].values()} == {"partial"}
+    assert len(tsl_rejected) == 2
@@ -0,0 +1,38 @@
+import math
+
+import numpy as np
+import pytest
+
+import kernels
+
+# Las dos implementaciones tienen que dar exactamente lo mismo.
+KERNELS = [kernels._quantize_batch_numpy]
+if kernels.njit is not None:
+    KERNELS.append(kernels._quantize_batch_jit)
+
+
+@pytest.fixture(params=KERNELS, ids=lambda k: k.__name__)
+def quantize(request):
+    return request.param
+
+
+def test_quantity_is_multiple_of_step(quantize):
+    # 1000 de nocional con pasos 0.001, 1, 10 y 0.3.
+    out = quantize(
+        1000.0 / np.array([300.0, 3.0, 0.3, 3.0]),
+        np.array([0.001, 1.0, 10.0, 0.3]),
+        np.array([1000.0, 1.0, 1.0, 10.0]),
+        np.array([0.001, 1.0, 10.0, 0.3]),
+    )
+    assert out.tolist() == [3.333, 333.0, 3330.0, 333.3]
+
+
+def test_invalid_inputs_never_reach_an_order(quantize):
+    out = quantize(np.array([math.nan, 5.0, 0.0001, math.inf]), np.array([0.001, 0.0, 0.001, 0.001]),
+                   np.array([1000.0, 1.0, 1000.0, 1000.0]), np.array([0.001, 0.001, 0.001, 0.001]))
+    assert out.tolist() == [0.0, 0.0, 0.0, 0.0]
+
+
+def test_numba_kernel_is_used_when_available():
+    expected = kernels._quantize_batch_numpy if kernels.njit is None else kernels._quantize_batch_jit
+    assert kernels.quantize_batch is expected
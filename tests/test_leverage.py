@@ -0,0 +1,42 @@
+from unittest import mock
+
+import pytest
+from binance.exceptions import BinanceAPIException
+
+
+@pytest.fixture
+def leverage_cache(server, monkeypatch):
+    cache = {}
+    monkeypatch.setattr(server, "_leverage_cache", cache)
+    return cache
+
+
+def test_leverage_is_seeded_from_symbol_config(server, monkeypatch, leverage_cache):
+    monkeypatch.setattr(server.client, "futures_symbol_config",
+                        lambda: [{"symbol": "BTCUSDT", "leverage": 20}, {"symbol": "ONEUSDT", "leverage": "5"}])
+    server.load_leverages()
+    assert leverage_cache == {"BTCUSDT": 20, "ONEUSDT": 5}
+
+
+def test_unchanged_leverage_skips_api_call(server, monkeypatch, leverage_cache):
+    change = mock.Mock()
+    monkeypatch.setattr(server.client, "futures_change_leverage", change)
+    leverage_cache["BTCUSDT"] = 10
+    server.ensure_leverage("BTCUSDT", 10)
+    change.assert_not_called()
+    server.ensure_leverage("BTCUSDT", 15)
+    change.assert_called_once_with(symbol="BTCUSDT", leverage=15)
+    assert leverage_cache["BTCUSDT"] == 15
+
+
+def test_rejected_order_drops_cached_leverage(server, monkeypatch, leverage_cache):
+    def reject(**params):
+        raise BinanceAPIException(mock.Mock(status_code=400), 400, '{"code": -2019, "msg": "margen insuficiente"}')
+
+    leverage_cache["BTCUSDT"] = 10
+    monkeypatch.setattr(server, "close_position_for_symbol", lambda s: (True, "No position to close."))
+    monkeypatch.setattr(server, "get_mark_price", lambda s: 300.0)
+    monkeypatch.setattr(server.client, "futures_create_order", reject)
+    status, _ = server._process_single(server.Signal(symbol="BTCUSDT", side="LONG", lev=10, usdt=100))
+    assert status == 500
+    assert "BTCUSDT" not in leverage_cache
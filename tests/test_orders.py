@@ -0,0 +1,47 @@
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def open_orders(server, monkeypatch):
+    tracked = set()
+    monkeypatch.setattr(server, "symbols_with_open_orders", tracked)
+    monkeypatch.setattr(server, "get_open_position", lambda s: 0.5)
+    monkeypatch.setattr(server.client, "futures_create_order", mock.Mock(return_value={"orderId": 1, "updateTime": 1}))
+    monkeypatch.setattr(server.client, "futures_cancel_all_open_orders", mock.Mock())
+    return tracked
+
+
+def test_close_skips_cancel_without_open_orders(server, open_orders):
+    assert server.close_position_for_symbol("BTCUSDT") == (True, 1)
+    server.client.futures_cancel_all_open_orders.assert_not_called()
+
+
+def test_close_cancels_regular_and_conditional_orders(server, open_orders):
+    open_orders.add("BTCUSDT")
+    assert server.close_position_for_symbol("BTCUSDT") == (True, 1)
+    cancel = server.client.futures_cancel_all_open_orders
+    assert cancel.call_count == 2
+    cancel.assert_has_calls([mock.call(symbol="BTCUSDT"), mock.call(symbol="BTCUSDT", conditional=True)],
+                            any_order=True)
+    assert "BTCUSDT" not in open_orders
+
+
+def test_trailing_stop_registers_open_orders(server, open_orders, monkeypatch):
+    def create_order(**params):
+        if params["type"] == "TRAILING_STOP_MARKET":
+            return {"algoId": 9, "updateTime": 2}
+        return {"orderId": 1, "updateTime": 1}
+
+    monkeypatch.setattr(server.client, "futures_create_order", create_order)
+    order, tsl_error = server.place_market_order("BTCUSDT", "BUY", 0.01, 1)
+    assert order["orderId"] == 1 and tsl_error is None
+    assert "BTCUSDT" in open_orders
+
+
+def test_boot_registers_conditional_orders(server, open_orders, monkeypatch):
+    monkeypatch.setattr(server.client, "futures_get_open_orders", lambda conditional=False: (
+        [{"symbol": "ONEUSDT"}] if conditional else [{"symbol": "BTCUSDT"}]))
+    server.load_open_orders()
+    assert open_orders == {"BTCUSDT", "ONEUSDT"}
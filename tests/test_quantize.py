@@ -0,0 +1,20 @@
+import pytest
+
+# 100 USDT x10 = 1000 de nocional.
+QUANT_CASES = [
+    ("BTCUSDT", 300.0, 3.333),   # stepSize 0.001
+    ("ONEUSDT", 3.0, 333.0),     # stepSize 1
+    ("TENUSDT", 0.3, 3330.0),    # stepSize 10
+]
+
+
+@pytest.mark.parametrize("symbol,mark,expected", QUANT_CASES)
+def test_single_quantity_is_multiple_of_step(server, monkeypatch, symbol, mark, expected):
+    sent = []
+    monkeypatch.setattr(server, "close_position_for_symbol", lambda s: (True, "No position to close."))
+    monkeypatch.setattr(server, "ensure_leverage", lambda s, lev: None)
+    monkeypatch.setattr(server, "get_mark_price", lambda s: mark)
+    monkeypatch.setattr(server, "place_market_order", lambda s, side, q, tsl: sent.append(q) or ({"orderId": 1}, None))
+    status, _ = server._process_single(server.Signal(symbol=symbol, side="LONG", lev=10, usdt=100))
+    assert status == 200
+    assert sent == [expected]
@@ -0,0 +1,23 @@
+import pytest
+
+
+@pytest.mark.parametrize("fields", [
+    {"lev": 10, "usdt": "inf"},
+    {"lev": 10, "usdt": -5},
+    {"lev": 0, "usdt": 100},
+    {"lev": "nan", "usdt": 100},
+    {"lev": 10},
+])
+def test_invalid_open_is_rejected_before_closing(server, post, monkeypatch, fields):
+    calls = []
+    monkeypatch.setattr(server, "close_position_for_symbol", lambda s: calls.append(s) or (True, 1))
+    resp = post({"symbol": "BTCUSDT", "side": "LONG", **fields})
+    assert resp.status_code == 400
+    assert calls == []
+
+
+def test_invalid_multi_symbol_open_is_rejected(server, post, monkeypatch):
+    calls = []
+    monkeypatch.setattr(server, "close_position_for_symbol", lambda s: calls.append(s) or (True, 1))
+    assert post({"symbol": ["BTCUSDT", "ONEUSDT"], "side": "LONG", "lev": 10, "usdt": "nan"}).status_code == 400
+    assert calls == []
@@ -0,0 +1,31 @@
+def account_update(symbol, amount, t):
+    return {"e": "ACCOUNT_UPDATE", "T": t, "a": {"P": [{"s": symbol, "pa": str(amount), "ps": "BOTH"}]}}
+
+
+def test_fence_ignores_events_older_than_last_order(server):
+    server.invalidate_cache("BTCUSDT", {"orderId": 1, "updateTime": 2000})
+    server._on_user_event(account_update("BTCUSDT", 1.0, 1500))
+    assert server._stream_position("BTCUSDT") is None
+    server._on_user_event(account_update("BTCUSDT", 0.5, 2500))
+    assert server._stream_position("BTCUSDT") == 0.5
+    # Una orden posterior descarta el valor hasta su propio ACCOUNT_UPDATE.
+    server.invalidate_cache("BTCUSDT", {"orderId": 2, "updateTime": 3000})
+    server._on_user_event(account_update("BTCUSDT", 0.5, 2500))
+    assert server._stream_position("BTCUSDT") is None
+
+
+def test_user_stream_error_falls_back_to_rest(server, monkeypatch):
+    server._on_user_event(account_update("BTCUSDT", 0.5, 1))
+    server._on_user_event({"e": "error", "m": "desconectado"})
+    monkeypatch.setattr(server.client, "futures_position_information",
+                        lambda symbol: [{"positionAmt": "0.25"}])
+    assert server.get_open_position("BTCUSDT") == 0.25
+
+
+def test_stale_stream_position_falls_back_to_rest(server, monkeypatch):
+    server._on_user_event(account_update("BTCUSDT", 0.5, 1))
+    # Recibido hace más de STREAM_POSITION_MAX_AGE segundos.
+    amount, received = server._stream_positions["BTCUSDT"]
+    server._stream_positions["BTCUSDT"] = (amount, received - server.STREAM_POSITION_MAX_AGE - 1)
+    monkeypatch.setattr(server.client, "futures_position_information", lambda symbol: [{"positionAmt": "0.25"}])
+    assert server.get_open_position("BTCUSDT") == 0.25
@@ -0,0 +1,31 @@
+from unittest import mock
+
+import pytest
+
+from conftest import EXCHANGE_INFO
+
+
+@pytest.fixture
+def exchange_info(server, monkeypatch):
+    download = mock.Mock(return_value=EXCHANGE_INFO)
+    monkeypatch.setattr(server.client, "futures_exchange_info", download)
+    monkeypatch.setattr(server, "_symbol_info_misses", {})
+    monkeypatch.setattr(server, "_last_symbol_refresh", 0.0)
+    return download
+
+
+def test_malformed_symbol_is_skipped(server):
+    assert "BADUSDT" not in server.symbol_info_cache
+    assert server.get_symbol_info("BTCUSDT")["stepScale"] == 1000.0
+
+
+def test_unknown_symbol_is_remembered(server, exchange_info):
+    assert server.get_symbol_info("NOPEUSDT") is None
+    assert server.get_symbol_info("NOPEUSDT") is None
+    assert exchange_info.call_count == 1
+
+
+def test_refresh_is_rate_limited_across_symbols(server, exchange_info):
+    assert server.get_symbol_info("NOPEUSDT") is None
+    assert server.get_symbol_info("OTHERUSDT") is None
+    assert exchange_info.call_count == 1